@@ -9,34 +9,155 @@ Author: Zoltan Fabian
 Date: 2025-08-15
 """
 
-import re
+import io
 import json
+import os
+import string
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
-from typing import Dict, List, Any, Set
-from collections import defaultdict
+from typing import Dict, Iterable, List, Any, Set, Tuple
+from collections import Counter
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+try:
+    import simdjson
+except ImportError:  # pragma: no cover - simdjson is optional
+    simdjson = None
+
+try:
+    import ijson
+except ImportError:  # pragma: no cover - ijson is optional
+    ijson = None
+
+
+# Intermediate node/link records are kept as tuples instead of dicts to cut
+# the per-element memory footprint; the output dicts are only materialized
+# batch by batch while serializing.
+NodeRecord = Tuple[str, str, List[Any], int]
+LinkRecord = Tuple[str, str, str, int]
+
+# How many records to materialize and serialize per _dumps call.
+_SERIALIZE_BATCH = 16384
+
+# Above this many input elements, extraction is sharded across a process
+# pool; below it the pickling overhead outweighs the parallelism.
+_PARALLEL_THRESHOLD = 200_000
+
+
+def _loads(data):
+    """Parse JSON from str or bytes, using orjson when available."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _dumps(obj) -> bytes:
+    """Serialize to compact JSON bytes, using orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _node_dict(node: NodeRecord) -> Dict[str, Any]:
+    """Materialize the D3.js node object for a node record."""
+    node_id, node_type, observations, group = node
+    return {
+        "id": node_id,
+        "type": node_type,
+        "observations": observations,
+        "group": group,
+    }
+
+
+def _link_dict(link: LinkRecord) -> Dict[str, Any]:
+    """Materialize the D3.js link object for a link record."""
+    source, target, rel_type, value = link
+    return {"source": source, "target": target, "type": rel_type, "value": value}
+
+
+def _write_json_array(file, records: List, build) -> None:
+    """
+    Write records as a JSON array, materializing and serializing the
+    output dicts in fixed-size batches so each list still goes through
+    orjson's C-level fast path without ever existing whole in memory.
+    """
+    file.write(b"[")
+    for start in range(0, len(records), _SERIALIZE_BATCH):
+        if start:
+            file.write(b",")
+        batch = [build(record) for record in records[start : start + _SERIALIZE_BATCH]]
+        file.write(_dumps(batch)[1:-1])
+    file.write(b"]")
+
+
+def _write_d3_graph(
+    output_path: Path,
+    nodes: List[NodeRecord],
+    links: List[LinkRecord],
+    metadata: Dict[str, Any],
+) -> None:
+    """
+    Stream the D3.js graph object to the output file.
+
+    Writes the JSON framing directly and serializes nodes and links in
+    batches, so the dict form of the graph is never held in memory as a
+    whole. Output is compact since it is consumed by the visualizer, not
+    read by humans.
+
+    Args:
+        output_path: Destination file path
+        nodes: List of node records
+        links: List of link records
+        metadata: Metadata object for the graph
+    """
+    with open(output_path, "wb") as file:
+        file.write(b'{"nodes":')
+        _write_json_array(file, nodes, _node_dict)
+        file.write(b',"links":')
+        _write_json_array(file, links, _link_dict)
+        file.write(b',"metadata":')
+        file.write(_dumps(metadata))
+        file.write(b"}")
+
+
+_SAFE_CHARS = frozenset(string.ascii_letters + string.digits + "_.-")
+
+
+class _SanitizeTable(dict):
+    """Translation table that maps any character outside _SAFE_CHARS to "_"."""
+
+    def __missing__(self, code):
+        return "_"
+
+
+_SANITIZE_TABLE = _SanitizeTable({ord(char): char for char in _SAFE_CHARS})
 
 
 # Sanitize the filename: remove path separators and allow only safe chars
 def simple_secure_filename(filename):
-    filename = re.sub(r"[\\/]", "", filename)  # Remove slashes
-    filename = re.sub(r"[^A-Za-z0-9_.-]", "_", filename)  # Replace unsafe chars
-    return filename or "output.json"
+    filename = filename.replace("\\", "").replace("/", "")  # Remove slashes
+    return filename.translate(_SANITIZE_TABLE) or "output.json"
 
 
-def load_knowledge_graph(json_file_path: str) -> Dict[str, Any]:
+def _read_graph_bytes(json_file_path: str) -> bytes:
     """
-    Load and validate the knowledge graph JSON file.
+    Read the raw bytes of a knowledge graph file after path validation.
 
     Args:
         json_file_path: Path to the knowledge graph JSON file
 
     Returns:
-        Parsed JSON data as dictionary
+        Raw file contents as bytes
 
     Raises:
         FileNotFoundError: If the input file doesn't exist
-        json.JSONDecodeError: If the file contains invalid JSON
+        ValueError: If the path escapes the allowed directory
     """
     file_path = Path(json_file_path).resolve()
     allowed_dir = Path(__file__).parent.resolve()
@@ -48,18 +169,61 @@ def load_knowledge_graph(json_file_path: str) -> Dict[str, Any]:
     if not file_path.exists():
         raise FileNotFoundError(f"Knowledge graph file not found: {json_file_path}")
 
+    return file_path.read_bytes()
+
+
+def _payload_text(json_file_path: str) -> str:
+    """
+    Extract the nested graph payload string from the envelope file.
+
+    When simdjson is available the envelope is scanned lazily with a JSON
+    pointer, so only the `result.content[0].text` string is materialized
+    instead of the whole outer document. Falls back to a full parse via
+    load_knowledge_graph otherwise.
+
+    Args:
+        json_file_path: Path to the knowledge graph JSON file
+
+    Returns:
+        The inner JSON document as a string
+    """
+    if simdjson is not None:
+        raw = _read_graph_bytes(json_file_path)
+        try:
+            return simdjson.Parser().parse(raw).at_pointer("/result/content/0/text")
+        except ValueError as exc:
+            # Non-UTF-8 input or unexpected structure; retry with the
+            # encoding-tolerant loader below.
+            print(str(exc))
+
+    data = load_knowledge_graph(json_file_path)
+    return data["result"]["content"][0]["text"]
+
+
+def load_knowledge_graph(json_file_path: str) -> Dict[str, Any]:
+    """
+    Load and validate the knowledge graph JSON file.
+
+    Args:
+        json_file_path: Path to the knowledge graph JSON file
+
+    Returns:
+        Parsed JSON data as dictionary
+
+    Raises:
+        FileNotFoundError: If the input file doesn't exist
+        json.JSONDecodeError: If the file contains invalid JSON
+    """
+    raw = _read_graph_bytes(json_file_path)
+    if raw.startswith(b"\xef\xbb\xbf"):
+        raw = raw[3:]
+
     # Try different encodings to handle various file formats
-    encodings = ["utf-8-sig", "utf-8", "utf-16", "cp1252"]
+    encodings = ["utf-8", "utf-16", "cp1252"]
 
     for encoding in encodings:
         try:
-            # Sanitize the filename to prevent path traversal
-            safe_filename = simple_secure_filename(file_path.name)
-            safe_path = allowed_dir / safe_filename
-            if not str(safe_path.resolve()).startswith(str(allowed_dir)):
-                raise ValueError(f"Path traversal detected: {safe_path}")
-            with open(safe_path, "r", encoding=encoding) as file:
-                return json.load(file)
+            return _loads(raw.decode(encoding))
         except (UnicodeDecodeError, json.JSONDecodeError) as exc:
             print(str(exc))
             continue
@@ -71,88 +235,204 @@ def load_knowledge_graph(json_file_path: str) -> Dict[str, Any]:
 
 
 def extract_nodes(
-    entities: List[Dict[str, Any]], existing_groups: Set[str]
-) -> List[Dict[str, Any]]:
+    entities: Iterable[Dict[str, Any]],
+) -> Tuple[List[NodeRecord], Dict[str, int]]:
     """
-    Convert entities to D3.js nodes format.
+    Convert entities to node records in a single pass.
+
+    Group indices are assigned in order of first appearance, so no
+    separate pass over the entities is needed to enumerate the types.
 
     Args:
         entities: List of entity dictionaries from knowledge graph
 
     Returns:
-        List of D3.js compatible node objects
+        Tuple of ((id, type, observations, group) records,
+        {entity type: group index})
     """
-    nodes = []
+    if isinstance(entities, list) and len(entities) > _PARALLEL_THRESHOLD:
+        return _extract_nodes_parallel(entities)
+
+    group_index: Dict[str, int] = {}
+    assign_group = group_index.setdefault
+    intern = sys.intern
+    nodes = [
+        (
+            intern(entity["name"]),
+            (
+                entity_type := entity["entityType"]
+                if "entityType" in entity
+                else "Unknown"
+            ),
+            entity["observations"] if "observations" in entity else [],
+            assign_group(entity_type, len(group_index)),
+        )
+        for entity in entities
+        if entity.get("type") == "entity"
+    ]
+
+    return nodes, group_index
+
+
+def _node_records_chunk(
+    entities: List[Dict[str, Any]], group_index: Dict[str, int]
+) -> List[NodeRecord]:
+    """Build node records for one chunk against a prebuilt group index."""
+    intern = sys.intern
+    return [
+        (
+            intern(entity["name"]),
+            (
+                entity_type := entity["entityType"]
+                if "entityType" in entity
+                else "Unknown"
+            ),
+            entity["observations"] if "observations" in entity else [],
+            group_index[entity_type],
+        )
+        for entity in entities
+        if entity.get("type") == "entity"
+    ]
+
+
+def _extract_nodes_parallel(
+    entities: List[Dict[str, Any]],
+) -> Tuple[List[NodeRecord], Dict[str, int]]:
+    """
+    Shard node extraction across a process pool.
 
+    The group index must reflect global first-appearance order, so it is
+    built in a cheap serial pre-pass; the record construction, which does
+    the bulk of the allocation work, then runs chunk-wise in parallel.
+    """
+    group_index: Dict[str, int] = {}
+    assign_group = group_index.setdefault
     for entity in entities:
-        if entity.get("type") != "entity":
-            continue
+        if entity.get("type") == "entity":
+            assign_group(
+                entity["entityType"] if "entityType" in entity else "Unknown",
+                len(group_index),
+            )
 
-        node = {
-            "id": entity["name"],
-            "type": entity.get("entityType", "Unknown"),
-            "observations": entity.get("observations", []),
-            "group": _get_group_index(
-                entity.get("entityType", "Unknown"), existing_groups
-            ),
-        }
-        nodes.append(node)
+    workers = os.cpu_count() or 1
+    chunk_size = -(-len(entities) // workers)
+    chunks = [
+        entities[start : start + chunk_size]
+        for start in range(0, len(entities), chunk_size)
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parts = pool.map(_node_records_chunk, chunks, repeat(group_index))
+        nodes = [record for part in parts for record in part]
 
-    return nodes
+    return nodes, group_index
 
 
 def extract_links(
-    relations: List[Dict[str, Any]], relation_types: Dict[str, int]
-) -> List[Dict[str, Any]]:
+    relations: Iterable[Dict[str, Any]],
+) -> Tuple[List[LinkRecord], Set[str]]:
     """
-    Convert relations to D3.js links format.
+    Convert relations to link records in a single pass.
+
+    The link value is the occurrence count of its relation type, which is
+    only known once all relations are seen, so the raw (from, to, type)
+    triples are collected while counting and the value is attached
+    afterwards.
 
     Args:
         relations: List of relation dictionaries from knowledge graph
 
     Returns:
-        List of D3.js compatible link objects
+        Tuple of ((source, target, type, value) records,
+        distinct relation types seen)
     """
-    links = []
+    if isinstance(relations, list) and len(relations) > _PARALLEL_THRESHOLD:
+        return _extract_links_parallel(relations)
+
+    raw, counts = _link_triples_chunk(relations)
+    links = [
+        (source, target, rel_type, counts[rel_type])
+        for source, target, rel_type in raw
+    ]
+
+    return links, set(counts)
+
+
+def _link_triples_chunk(
+    relations: Iterable[Dict[str, Any]],
+) -> Tuple[List[Tuple[str, str, str]], Counter]:
+    """Collect (from, to, type) triples and type counts for one chunk."""
+    counts: Counter = Counter()
+    raw = []
+    append = raw.append
+    intern = sys.intern
 
     for relation in relations:
         if relation.get("type") != "relation":
             continue
+        rel_type = relation["relationType"]
+        counts[rel_type] += 1
+        append((intern(relation["from"]), intern(relation["to"]), rel_type))
 
-        link = {
-            "source": relation["from"],
-            "target": relation["to"],
-            "type": relation["relationType"],
-            "value": _get_relation_strength(relation["relationType"], relation_types),
-        }
-        links.append(link)
+    return raw, counts
 
-    return links
 
+def _extract_links_parallel(
+    relations: List[Dict[str, Any]],
+) -> Tuple[List[LinkRecord], Set[str]]:
+    """
+    Shard link extraction across a process pool.
 
-def validate_graph_integrity(nodes: List[Dict], links: List[Dict]) -> bool:
+    Each worker collects triples and local type counts for its chunk; the
+    counters are merged before the link values are attached, so the counts
+    match the serial path exactly.
+    """
+    workers = os.cpu_count() or 1
+    chunk_size = -(-len(relations) // workers)
+    chunks = [
+        relations[start : start + chunk_size]
+        for start in range(0, len(relations), chunk_size)
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parts = list(pool.map(_link_triples_chunk, chunks))
+
+    counts: Counter = Counter()
+    for _, part_counts in parts:
+        counts.update(part_counts)
+
+    links = [
+        (source, target, rel_type, counts[rel_type])
+        for raw, _ in parts
+        for source, target, rel_type in raw
+    ]
+
+    return links, set(counts)
+
+
+def validate_graph_integrity(
+    nodes: List[NodeRecord], links: List[LinkRecord]
+) -> bool:
     """
     Validate that all links reference existing nodes.
 
     Args:
-        nodes: List of node objects
-        links: List of link objects
+        nodes: List of node records
+        links: List of link records
 
     Returns:
         True if graph is valid, False otherwise
     """
-    node_ids = {node["id"] for node in nodes}
-    missing_nodes = set()
-
-    for link in links:
-        if link["source"] not in node_ids:
-            print(f"Warning: Link source '{link['source']}' not found in nodes")
-            missing_nodes.add(link["source"])
-        if link["target"] not in node_ids:
-            print(f"Warning: Link target '{link['target']}' not found in nodes")
-            missing_nodes.add(link["target"])
+    node_ids = {node[0] for node in nodes}
+    sources = {link[0] for link in links}
+    targets = {link[1] for link in links}
+    missing_nodes = (sources | targets) - node_ids
 
     if missing_nodes:
+        # Cold path: walk the links again only to report the offenders.
+        for source, target, _rel_type, _value in links:
+            if source in missing_nodes:
+                print(f"Warning: Link source '{source}' not found in nodes")
+            if target in missing_nodes:
+                print(f"Warning: Link target '{target}' not found in nodes")
         print(f"Found {len(missing_nodes)} missing nodes: {missing_nodes}")
         print(
             "Consider adding these as entities or use --no-validate to skip validation"
@@ -162,69 +442,6 @@ def validate_graph_integrity(nodes: List[Dict], links: List[Dict]) -> bool:
     return True
 
 
-def extract_relation_types(relations: List[Dict[str, Any]]) -> Dict[str, int]:
-    """
-    Extract relation types from the knowledge graph.
-
-    Args:
-        relations: List of relation dictionaries from knowledge graph
-
-    Returns:
-        Dictionary mapping relation types to lists of relation objects
-    """
-    relation_types = defaultdict(list)
-
-    for i, relation in enumerate(relations):
-        rel_type = relation.get("relationType", "Unknown")
-        relation_types.update({rel_type: relation_types.get(rel_type, 0) + 1})
-    return relation_types
-
-
-def _get_relation_strength(relation_type: str, relation_types: Dict[str, int]) -> int:
-    """
-    Get the strength of a link based on its relation type.
-
-    Args:
-        relation_type: The type of the relation
-
-    Returns:
-        Strength value for the link
-    """
-    return relation_types.get(relation_type, 0)
-
-
-def extract_groups(entities: List[Dict[str, Any]]) -> List[str]:
-    """
-    Extract entity types from the knowledge graph.
-
-    Args:
-        entities: List of entity dictionaries from knowledge graph
-
-    Returns:
-        Dictionary mapping group numbers to lists of entity types
-    """
-    groups = set()
-    for i, entity in enumerate(entities):
-        group = entity.get("entityType", "Unknown")
-        groups.add(group)
-    return sorted(list(groups))
-
-
-def _get_group_index(entity_type: str, groups: Set[str]) -> int:
-    """
-    Get the group index for a given entity type.
-
-    Args:
-        entity_type: The type of the entity
-
-    Returns:
-        Group index as an integer
-    """
-    if entity_type in groups:
-        return list(groups).index(entity_type)
-    return 0
-
-
 def convert_to_d3(input_file: str, output_file: str, validate: bool = True) -> None:
     """
     Convert knowledge graph JSON to D3.js compatible format.
@@ -238,42 +455,64 @@ def convert_to_d3(input_file: str, output_file: str, validate: bool = True) -> N
         ValueError: If the knowledge graph structure is invalid
     """
     try:
-        # Load the knowledge graph
-        data = load_knowledge_graph(input_file)
-
-        # Validate required structure
-        content = json.loads(data["result"]["content"][0]["text"])
-        if "entities" not in content:
-            raise ValueError("Knowledge graph must contain 'entities' array")
-        if "relations" not in content:
-            raise ValueError("Knowledge graph must contain 'relations' array")
-
-        # Extract nodes and links
-        groups = extract_groups(content["entities"])
-        relation_types = extract_relation_types(content["relations"])
-        nodes = extract_nodes(content["entities"], groups)
-        links = extract_links(content["relations"], relation_types)
-
-        # Clean up
-        del content
-        del data
+        # Load the nested graph payload
+        payload = _payload_text(input_file)
+
+        if ijson is not None:
+            # Stream entities and relations straight out of the payload so
+            # only the nodes/links lists are ever held in memory, never the
+            # full parsed document.
+            payload_bytes = payload.encode("utf-8")
+            del payload
+
+            def stream(prefix: str):
+                return ijson.items(io.BytesIO(payload_bytes), prefix, use_float=True)
+
+            # Validate required structure from the top-level map keys alone,
+            # stopping as soon as both are seen, without materializing values.
+            top_keys = set()
+            for prefix, event, value in ijson.parse(io.BytesIO(payload_bytes)):
+                if event == "map_key" and prefix == "":
+                    top_keys.add(value)
+                    if "entities" in top_keys and "relations" in top_keys:
+                        break
+
+            if "entities" not in top_keys:
+                raise ValueError("Knowledge graph must contain 'entities' array")
+            if "relations" not in top_keys:
+                raise ValueError("Knowledge graph must contain 'relations' array")
+
+            nodes, group_index = extract_nodes(stream("entities.item"))
+            links, link_types = extract_links(stream("relations.item"))
+        else:
+            content = _loads(payload)
+            del payload
+
+            # Validate required structure
+            if "entities" not in content:
+                raise ValueError("Knowledge graph must contain 'entities' array")
+            if "relations" not in content:
+                raise ValueError("Knowledge graph must contain 'relations' array")
+
+            # Extract nodes and links
+            nodes, group_index = extract_nodes(content["entities"])
+            links, link_types = extract_links(content["relations"])
+
+            # Clean up
+            del content
 
         # Validate graph integrity if requested
         if validate and not validate_graph_integrity(nodes, links):
             raise ValueError("Graph integrity validation failed")
 
-        # Create D3.js compatible graph object
-        d3_graph = {
-            "nodes": nodes,
-            "links": links,
-            "metadata": {
-                "nodeCount": len(nodes),
-                "linkCount": len(links),
-                "entityTypes": list(set(node["type"] for node in nodes)),
-                "relationTypes": list(set(link["type"] for link in links)),
-                "generatedAt": "2025-01-14",
-                "source": input_file,
-            },
+        # Metadata for the D3.js graph object
+        metadata = {
+            "nodeCount": len(nodes),
+            "linkCount": len(links),
+            "entityTypes": list(group_index),
+            "relationTypes": list(link_types),
+            "generatedAt": "2025-01-14",
+            "source": input_file,
         }
 
         # Write the D3.js graph to output file
@@ -284,8 +523,7 @@ def convert_to_d3(input_file: str, output_file: str, validate: bool = True) -> N
         # Ensure output_path is within allowed_dir (prevent path traversal)
         if not str(output_path.resolve()).startswith(str(allowed_dir)):
             raise ValueError("Output file path traversal detected.")
-        with open(output_path, "w", encoding="utf-8") as file:
-            json.dump(d3_graph, file, indent=2, ensure_ascii=False)
+        _write_d3_graph(output_path, nodes, links, metadata)
 
         print("✓ Successfully converted knowledge graph to D3.js format")
         print(f"  Input:  {input_file}")